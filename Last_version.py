@@ -1,30 +1,65 @@
 import asyncio
+import atexit
+import concurrent.futures
+import functools
 import json
 import logging
-import re
-import sys
+import logging.handlers
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
 from enum import Enum
-from typing import NamedTuple
 
 import toml
 from sanic import Sanic
-from sanic.response import json as sanic_json
+from sanic.response import HTTPResponse, json as sanic_json
 from tenacity import after_log, retry, retry_if_result, stop_after_attempt, wait_fixed
-import traceback
 
 import MetaTrader5 as mt5
-import pytz
-from datetime import datetime
+import numpy as np
+import orjson
+from datetime import datetime, timedelta, timezone
+
+try:
+    from numba import njit
+except ImportError:  # 没装 numba 时退化为普通 Python 函数，结果一致只是慢一些
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
 
 # 日志配置
+# 实际的写文件/控制台由后台线程的 QueueListener 完成，业务代码只往队列里放记录
+log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+file_handler = logging.FileHandler("trading_bot.log", encoding='utf-8')
+file_handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
 logging.basicConfig(level=logging.INFO,
-                    format="%(asctime)s [%(levelname)s] %(message)s",
-                    handlers=[
-                        logging.StreamHandler(),
-                        logging.FileHandler("trading_bot.log", encoding='utf-8')
-                    ])
+                    format="%(message)s",
+                    handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener = logging.handlers.QueueListener(log_queue, stream_handler, file_handler)
+log_listener.start()
 logger = logging.getLogger(__name__)
 
+_log_listener_stopped = False
+
+
+def stop_log_listener():
+    """ 停止日志线程，队列里剩余的记录会先写完；停机钩子和进程退出时都会调用，只执行一次 """
+    global _log_listener_stopped
+    if not _log_listener_stopped:
+        _log_listener_stopped = True
+        log_listener.stop()
+
+
+# 启动失败直接 quit() 时不会走停机钩子，退出前也要把队列里的日志写出去
+atexit.register(stop_log_listener)
+
 # 配置文件路径
 CONFIG_FILE_PATH = 'config.toml'
 
@@ -32,17 +67,70 @@ CONFIG_FILE_PATH = 'config.toml'
 with open(CONFIG_FILE_PATH, 'r', encoding='utf-8') as config_file:
     config = toml.load(config_file)
 
-# 获取MT5连接信息
-login = config['mt5']['login']
-password = config['mt5']['password']
-server = config['mt5']['server']
 
-# 获取止盈止损参数
-stop_loss_pips = config['trading']['stop_loss_pips']
-take_profit_pips = config['trading']['take_profit_pips']
+@dataclass(frozen=True, slots=True)
+class Settings:
+    # MT5连接信息
+    login: int
+    password: str
+    server: str
+    # 止盈止损参数 (点数)
+    sl_pips: float
+    tp_pips: float
+    # 开仓单的 magic 和允许滑点
+    magic: int = 234000
+    deviation: int = 20
+
+    @classmethod
+    def from_config(cls, config: dict):
+        trading = config['trading']
+        # magic / deviation 可选，配置里没有就用默认值
+        optional = {key: trading[key] for key in ('magic', 'deviation') if key in trading}
+        return cls(login=config['mt5']['login'],
+                   password=config['mt5']['password'],
+                   server=config['mt5']['server'],
+                   sl_pips=trading['stop_loss_pips'],
+                   tp_pips=trading['take_profit_pips'],
+                   **optional)
+
+
+settings = Settings.from_config(config)
+
+# 订单执行 worker 数量；同一品种的信号总是进同一个队列，按到达顺序执行
+ORDER_WORKERS = 8
+# 每个队列最多积压的信号数，满了直接返回 503
+ORDER_QUEUE_SIZE = 1024
+
+# 交易时段按北京时间判断 (固定 UTC+8，没有夏令时，不需要查时区库)
+_BJ_TZ = timezone(timedelta(hours=8))
+
+# 异步Sanic应用 (JSON 响应用 orjson 序列化；安装了 uvloop 时 Sanic 会自动使用)
+app = Sanic("AlgoBot", dumps=orjson.dumps)
+# webhook 成功时的响应内容固定，提前序列化好
+_ACK_BODY = orjson.dumps({'message': 'Signal received'})
+
+
+# 显式签名在导入时就编译(并写入磁盘缓存)，第一笔信号不用再等 JIT；
+# 用 float64[:] (任意布局) 以便直接接收结构化数组的字段视图
+@njit('float64(float64[:], float64[:], float64[:], int64)', cache=True, fastmath=True)
+def atr_wilder(high: np.ndarray, low: np.ndarray, close: np.ndarray, n: int) -> float:
+    """ 一次遍历计算真实波幅并做 Wilder 平滑，返回最后一个 ATR，至少需要 n + 1 根K线 """
+    # 前 n 根真实波幅的均值作为初始值
+    tr_sum = 0.0
+    for i in range(1, n + 1):
+        tr_sum += max(high[i] - low[i], abs(high[i] - close[i - 1]), abs(low[i] - close[i - 1]))
+    atr = tr_sum / n
+    for i in range(n + 1, close.shape[0]):
+        tr = max(high[i] - low[i], abs(high[i] - close[i - 1]), abs(low[i] - close[i - 1]))
+        atr = (atr * (n - 1) + tr) / n
+    return atr
+
+
+@njit('float64(float64[:], int64)', cache=True, fastmath=True)
+def sma_last(x: np.ndarray, n: int) -> float:
+    """ 最近 n 个值的简单移动平均 """
+    return x[-n:].mean()
 
-# 异步Sanic应用
-app = Sanic("AlgoBot")
 
 class DynamicStopLossTakeProfit:
     def __init__(self, symbol:str, action, take_profit, stop_loss, boll_periods, rsi_periods, trailing_stop_distance):
@@ -53,47 +141,94 @@ class DynamicStopLossTakeProfit:
         self.boll_periods = boll_periods
         self.rsi_periods = rsi_periods
         self.trailing_stop_distance = trailing_stop_distance
+        self._point = None
+        # 滚动均线的增量状态: (timeframe, window) -> (最新K线时间, 收盘价之和, 收盘价队列)
+        self._sma_state: dict[tuple, tuple] = {}
 
-    def get_price_data(self, timeframe, num_periods):
-        rates = mt5.copy_rates_from_pos(self.symbol, timeframe, 0, num_periods)
-        price_data = [rate['close'] for rate in rates]
-        return price_data
-
-    def calculate_average_true_range(self) -> float:
-        prices = self.get_price_data(mt5.TIMEFRAME_D1, 14)
-        high_prices = [bar.high for bar in prices]
-        low_prices = [bar.low for bar in prices]
-        close_prices = [bar.close for bar in prices]
+    @property
+    def point(self) -> float:
+        # 品种的 point 基本不变，第一次用到时获取后缓存
+        if self._point is None:
+            self._point = mt5.symbol_info(self.symbol).point
+        return self._point
 
-        atr = ta.average_true_range(high_prices, low_prices, close_prices, window=14)[-1]
+    def get_price_data(self, timeframe, num_periods):
+        """ 返回 MT5 的K线结构化数组，按字段取值: rates['close'] / rates['high'] / rates['low'] """
+        return mt5.copy_rates_from_pos(self.symbol, timeframe, 0, num_periods)
+
+    def calculate_average_true_range(self, window: int = 14, rates=None) -> float:
+        if rates is None:
+            # 多取一根K线，用作第一根的前收盘价
+            rates = self.get_price_data(mt5.TIMEFRAME_D1, window + 1)
+        # numba 内核不做越界检查，K线不足 (新品种/历史没同步完) 时必须在这里拦住
+        if rates is None or rates.shape[0] < window + 1:
+            raise ValueError(f"Need at least {window + 1} bars to compute ATR for {self.symbol}")
+        # 只有 window + 1 根K线时结果就是 window 个真实波幅的均值，K线更多时才有 Wilder 平滑
+        atr = atr_wilder(rates['high'], rates['low'], rates['close'], window)
 
         return atr
 
-    def calculate_moving_average(self) -> float:
-        prices = self.get_price_data(mt5.TIMEFRAME_D1, 14)
-        close_prices = [bar.close for bar in prices]
+    def calculate_moving_average(self, window: int = 14, rates=None) -> float:
+        if rates is None:
+            return self._rolling_sma(mt5.TIMEFRAME_D1, window)
 
-        ma = ta.sma(close_prices, window=14)[-1]
+        ma = sma_last(rates['close'], window)
 
         return ma
 
-    def adjust_trailing_stop(self):
-        price_data = self.get_price_data(mt5.TIMEFRAME_D1, 14)
-        # 如果是多单，且价格上涨，提高止损位
-        if self.action == ActionType.BUY.value and price_data[-1] > self.stop_loss + self.trailing_stop_distance:
-            self.stop_loss = price_data[-1] - self.trailing_stop_distance
-
-        # 如果是空单，且价格下跌，降低止损位
-        elif self.action == ActionType.SELL.value and price_data[-1] < self.stop_loss - self.trailing_stop_distance:
-            self.stop_loss = price_data[-1] + self.trailing_stop_distance
+    def _rolling_sma(self, timeframe, window: int) -> float:
+        """ 增量维护滚动和，每次只取最新两根K线；K线接不上时全量重算 """
+        key = (timeframe, window)
+        state = self._sma_state.get(key)
+        if state is not None:
+            last_time, total, closes = state
+            latest = self.get_price_data(timeframe, 2)
+            if latest is None or latest.shape[0] < 2:
+                # 取不到最新两根K线时没法增量更新，走全量重算
+                state = None
+            else:
+                prev_bar, cur_bar = latest
+                if cur_bar['time'] == last_time:
+                    # 还是同一根K线，只更新它的收盘价
+                    total += cur_bar['close'] - closes[-1]
+                    closes[-1] = cur_bar['close']
+                elif prev_bar['time'] == last_time:
+                    # 上一根K线已收盘，新K线进入窗口，最老的一根移出
+                    total += prev_bar['close'] - closes[-1]
+                    closes[-1] = prev_bar['close']
+                    total += cur_bar['close'] - closes[0]
+                    closes.append(cur_bar['close'])
+                else:
+                    state = None
+
+        if state is None:
+            rates = self.get_price_data(timeframe, window)
+            # 新品种/历史还没同步完时可能一根K线都没有
+            if rates is None or rates.shape[0] == 0:
+                self._sma_state.pop(key, None)
+                raise ValueError(f"No bars available to compute moving average for {self.symbol}")
+            closes = deque(rates['close'].tolist(), maxlen=window)
+            total = sum(closes)
+            cur_bar = rates[-1]
+            if len(closes) < window:
+                # K线不足一个窗口时不缓存状态 (增量更新要求窗口是满的)，按实际根数求均值
+                self._sma_state.pop(key, None)
+                return total / len(closes)
+
+        self._sma_state[key] = (cur_bar['time'], total, closes)
+        return total / window
+
+    def _compute_indicators(self, rates, window: int = 14) -> tuple[float, float]:
+        """ 用同一份K线数据计算 ATR 和 MA """
+        return self.calculate_average_true_range(window, rates), self.calculate_moving_average(window, rates)
 
     def calculate_fixed_sl_tp(self, stop_loss_pips: float, take_profit_pips: float) -> tuple[float, float]:
         # 获取当前市场价格
         current_price = mt5.symbol_info_tick(self.symbol).ask
 
         # 计算止盈价和止损价
-        stop_loss_price = current_price - stop_loss_pips * mt5.symbol_info(self.symbol).point
-        take_profit_price = current_price + take_profit_pips * mt5.symbol_info(self.symbol).point
+        stop_loss_price = current_price - stop_loss_pips * self.point
+        take_profit_price = current_price + take_profit_pips * self.point
 
         return stop_loss_price, take_profit_price
 
@@ -101,14 +236,14 @@ class DynamicStopLossTakeProfit:
         stop_loss_price, take_profit_price = self.calculate_fixed_sl_tp(stop_loss_pips, take_profit_pips)
         result = mt5.order_modify(self.symbol, stoploss=stop_loss_price, takeprofit=take_profit_price)
         if result.retcode != mt5.TRADE_RETCODE_DONE:
-            print(f"Failed to set dynamic stop loss/take profit for {self.symbol}: {result.comment}")
+            logger.error("Failed to set dynamic stop loss/take profit for %s: %s", self.symbol, result.comment)
         else:
-            print(f"Set dynamic stop loss/take profit for {self.symbol}: SL: {stop_loss_price}, TP: {take_profit_price}")
+            logger.info("Set dynamic stop loss/take profit for %s: SL: %s, TP: %s", self.symbol, stop_loss_price, take_profit_price)
 
     def adjust_stop_loss_take_profit(self):
-        price_data = self.get_price_data(mt5.TIMEFRAME_D1, 14)
-        atr = self.calculate_average_true_range()
-        ma = self.calculate_moving_average()
+        # 只取一次K线 (15根，ATR 需要前一根的收盘价)，ATR 和 MA 共用
+        rates = self.get_price_data(mt5.TIMEFRAME_D1, 15)
+        atr, ma = self._compute_indicators(rates)
 
         # adjust stop loss and take profit based on action
         if self.action == ActionType.BUY.value:
@@ -127,20 +262,20 @@ class DynamicStopLossTakeProfit:
         # 这里是调用 MT5 的函数修改订单
         result = mt5.order_modify(order, stoploss=stoploss_price, takeprofit=takeprofit_price)
         if result.retcode != mt5.TRADE_RETCODE_DONE:
-            print("Failed to modify order: ", result.comment)
+            logger.error("Failed to modify order: %s", result.comment)
         else:
-            print(f"Order modified successfully: SL: {stoploss_price}, TP: {takeprofit_price}")
+            logger.info("Order modified successfully: SL: %s, TP: %s", stoploss_price, takeprofit_price)
 
     def adjust_trailing_stop(self):
         """ 调整跟踪止损 """
-        price_data = self.get_price_data(mt5.TIMEFRAME_D1, 14)
+        last_close = self.get_price_data(mt5.TIMEFRAME_D1, 1)['close'][-1]
         # 如果是多单，且价格上涨，提高止损位
-        if self.action == ActionType.BUY.value and price_data[-1] > self.stop_loss + self.trailing_stop_distance:
-            self.stop_loss = price_data[-1] - self.trailing_stop_distance
+        if self.action == ActionType.BUY.value and last_close > self.stop_loss + self.trailing_stop_distance:
+            self.stop_loss = last_close - self.trailing_stop_distance
 
         # 如果是空单，且价格下跌，降低止损位
-        elif self.action == ActionType.SELL.value and price_data[-1] < self.stop_loss - self.trailing_stop_distance:
-            self.stop_loss = price_data[-1] + self.trailing_stop_distance
+        elif self.action == ActionType.SELL.value and last_close < self.stop_loss - self.trailing_stop_distance:
+            self.stop_loss = last_close + self.trailing_stop_distance
         
         # 更新止损位
         self.modify_sl_tp()
@@ -151,30 +286,56 @@ class ActionType(Enum):
     CLOSE = "CLOSE"
 
 
-class TradingSignal(NamedTuple):
-    action: str
+@dataclass(slots=True, frozen=True)
+class TradingSignal:
+    action: ActionType
     symbol: str
     volume: float
     open_position: str
     position_closed: str
 
-    def normalize_action(self):
-        if self.action.lower() in ['enter_long', 'buy']:
-            self = self._replace(action='BUY')
-        elif self.action.lower() in ['enter_short', 'sell']:
-            self = self._replace(action='SELL')
-        return self
+    # webhook 里 action 的各种写法 (小写后) 直接对应到 ActionType
+    _ACTION_MAP = {
+        b'enter_long': ActionType.BUY,
+        b'buy': ActionType.BUY,
+        b'enter_short': ActionType.SELL,
+        b'sell': ActionType.SELL,
+        b'close': ActionType.CLOSE,
+    }
 
     @classmethod
-    def from_webhook(cls, webhook_data: str):
-        pattern = r'action=(\w+);symbol=([\w/]+);volume=(.*);open_position=(.*);position_closed=(\w+_\d+)?'
-        match = re.match(pattern, webhook_data)
-        if not match:
+    def from_webhook(cls, webhook_data: bytes):
+        # 格式固定为 key=value;key=value，直接在原始 bytes 上 split，只解码用得到的值
+        try:
+            # 告警文本末尾常带换行/空格，先去掉，否则 position_closed 会匹配不到持仓的 comment
+            kv = {}
+            for part in webhook_data.strip().split(b';'):
+                if part:
+                    key, value = part.split(b'=', 1)
+                    kv[key.strip()] = value.strip()
+            action = cls._ACTION_MAP.get(kv[b'action'].lower())
+            if action is None:
+                raise ValueError(f"Unsupported action: {kv[b'action']!r}")
+            signal = cls(action=action,
+                         symbol=kv[b'symbol'].decode(), volume=float(kv[b'volume']),
+                         open_position=kv[b'open_position'].decode(),
+                         position_closed=kv.get(b'position_closed', b'').decode())
+        except (KeyError, ValueError) as e:
             logging.error("Invalid webhook data: %s", webhook_data)
-            raise ValueError("Invalid webhook data")
-        logging.info("Parsed signal: %s", match.groups())
+            raise ValueError("Invalid webhook data") from e
+        # execute_order 会在 INFO 级别再记一次同样的信号，这里只在 DEBUG 时输出
+        logger.debug("Parsed signal: %s", signal)
+
+        return signal
 
-        return cls(*match.groups())
+
+@functools.lru_cache(maxsize=2)
+def _tradetime(minute_bucket: int) -> int:
+    # 北京时间周末或 4:00-7:00 不交易
+    beijing_time = datetime.now(_BJ_TZ)
+    if beijing_time.weekday() >= 5 or 4 <= beijing_time.hour < 7:
+        return 0
+    return 1
 
 
 def is_requote_error(result):
@@ -184,126 +345,156 @@ def is_requote_error(result):
 
 
 class TradingBot:
-    def __init__(self, login: int, password: str, server: str):
-        self.login = login
-        self.password = password
-        self.server = server
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        # MT5 的调用都是阻塞的 IPC，放到线程池里执行，避免卡住事件循环
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="mt5")
+        # 行情/持仓查询可以并发，下单串行提交
+        self._order_lock = threading.Lock()
+        # 批量平仓时同时在途的平仓单上限
+        self._close_semaphore = asyncio.Semaphore(4)
+        # 不同品种的 worker 在非交易时间会同时触发全部平仓，串行执行避免同一仓位被重复平仓
+        self._close_all_lock = asyncio.Lock()
+        # 每个品种的 point 基本不变，连同由它算出的止损/止盈距离一起缓存，
+        # 省掉每笔订单的 symbol_info 调用: symbol -> (point, sl_offset, tp_offset)
+        self._sym_cache: dict[str, tuple[float, float, float]] = {}
         self.initialize_mt5()
 
     def initialize_mt5(self):
         if not mt5.initialize():
-            logging.error("initialize() failed, error code =", mt5.last_error())
+            logging.error("initialize() failed, error code = %s", mt5.last_error())
             quit()
 
-        authorized = mt5.login(self.login, self.password, server=self.server)
+        authorized = mt5.login(login=self.settings.login, password=self.settings.password, server=self.settings.server)
         if not authorized:
-            logging.error(f"Failed to connect to trade account with login = {self.login}")
-            logging.error(f"Error code = , {mt5.last_error()}")
+            logging.error("Failed to connect to trade account with login = %s", self.settings.login)
+            logging.error("Error code = %s", mt5.last_error())
             quit()
 
-        logging.info(f"Connected to trade account with login = {self.login}")
+        logging.info("Connected to trade account with login = %s", self.settings.login)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _symbol_offsets(self, symbol: str) -> tuple[float, float, float]:
+        cached = self._sym_cache.get(symbol)
+        if cached is None:
+            point = mt5.symbol_info(symbol).point
+            cached = (point, self.settings.sl_pips * point, self.settings.tp_pips * point)
+            self._sym_cache[symbol] = cached
+        return cached
+
+    def _order_send(self, trade_request: dict):
+        with self._order_lock:
+            return mt5.order_send(trade_request)
+
+    async def _run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
 
     async def execute_order(self, signal: TradingSignal):
         logging.info("Executing order: %s", signal)
         try:
             if self.is_trading_time() and signal.open_position:
-                if signal.action == ActionType.BUY:
-                    self.enter_long(signal)
+                if signal.action is ActionType.BUY:
+                    await self.enter_long(signal)
                     if signal.position_closed:
-                        self.close_position_by_comment(signal.position_closed)
-                elif signal.action == ActionType.SELL:
-                    self.enter_short(signal)
+                        await self.close_position_by_comment(signal.position_closed)
+                elif signal.action is ActionType.SELL:
+                    await self.enter_short(signal)
                     if signal.position_closed:
-                        self.close_position_by_comment(signal.position_closed)
+                        await self.close_position_by_comment(signal.position_closed)
                 else:
                     logging.error("Action is not supported.")
             else:
                 if not self.is_trading_time():
-                    self.close_all_positions()
-                    logging.error("Now is not trading time, all positions closed.")
+                    if await self.close_all_positions():
+                        logging.error("Now is not trading time, all positions closed.")
+                    else:
+                        logging.error("Now is not trading time, some positions could not be closed.")
                 else:
                     logging.error("Correct open position (like Long_12345) is required!")
         except Exception as err:
-            logging.error(f"An error occurred: {err}")
-            traceback.print_exc()
+            logger.exception("An error occurred: %s", err)
 
     @retry(retry=retry_if_result(is_requote_error), stop=stop_after_attempt(5), wait=wait_fixed(1),
-           reraise=True, after=after_log(logger, logging.DEBUG))
-    def enter_long(self, signal: TradingSignal):
-        logging.debug(f"Entering long with signal: {signal}")
+           reraise=True, after=after_log(logger, logging.WARNING))
+    def _enter(self, signal: TradingSignal, side: ActionType):
+        """ 开仓，多单 side 为 ActionType.BUY，空单为 ActionType.SELL """
+        is_buy = side is ActionType.BUY
+        direction = "long" if is_buy else "short"
+        logger.debug("Entering %s with signal: %s", direction, signal)
         symbol_info_tick = mt5.symbol_info_tick(signal.symbol)
-        ask = symbol_info_tick.ask
-        point = mt5.symbol_info(signal.symbol).point
+        price = symbol_info_tick.ask if is_buy else symbol_info_tick.bid
+        _, sl_offset, tp_offset = self._symbol_offsets(signal.symbol)
 
         trade_request = {
             "action": mt5.TRADE_ACTION_DEAL,
             "symbol": signal.symbol,
-            "volume": float(signal.volume),
-            "type": mt5.ORDER_TYPE_BUY,
-            "price": ask,
-            "sl": ask - stop_loss_pips * point,
-            "tp": ask + take_profit_pips * point,
-            "deviation": 20,
-            "magic": 234000,
+            "volume": signal.volume,
+            "type": mt5.ORDER_TYPE_BUY if is_buy else mt5.ORDER_TYPE_SELL,
+            "price": price,
+            "sl": price - sl_offset if is_buy else price + sl_offset,
+            "tp": price + tp_offset if is_buy else price - tp_offset,
+            "deviation": self.settings.deviation,
+            "magic": self.settings.magic,
             "comment": signal.open_position,
             "type_time": mt5.ORDER_TIME_GTC,
             "type_filling": mt5.ORDER_FILLING_IOC,
         }
 
-        trade_result = mt5.order_send(trade_request)
-        logging.debug(f"Trade result: {trade_result}")
+        trade_result = self._order_send(trade_request)
+        logger.debug("Trade result: %s", trade_result)
         if trade_result.retcode != mt5.TRADE_RETCODE_DONE:
-            logging.error("Trade failed, retcode={}".format(trade_result.retcode))
+            logger.error("Trade failed, retcode=%s", trade_result.retcode)
             logging.error(mt5.last_error())
+            # 下单失败时丢弃缓存，下次重新获取品种信息
+            self._sym_cache.pop(signal.symbol, None)
             raise Exception("Trade failed")
         else:
-            logging.info(f"Enter long {signal.open_position} processed successfully!")
+            logger.info("Enter %s %s processed successfully!", direction, signal.open_position)
         return trade_result
 
-    @retry(retry=retry_if_result(is_requote_error), stop=stop_after_attempt(5), wait=wait_fixed(1),
-           reraise=True, after=after_log(logger, logging.DEBUG))
-    def enter_short(self, signal: TradingSignal):
-        logging.debug(f"Entering short with signal: {signal}")
-        symbol_info_tick = mt5.symbol_info_tick(signal.symbol)
-        bid = symbol_info_tick.bid
-        point = mt5.symbol_info(signal.symbol).point
+    async def enter_long(self, signal: TradingSignal):
+        return await self._run_in_executor(self._enter, signal, ActionType.BUY)
 
-        trade_request = {
-            "action": mt5.TRADE_ACTION_DEAL,
-            "symbol": signal.symbol,
-            "volume": float(signal.volume),
-            "type": mt5.ORDER_TYPE_SELL,
-            "price": bid,
-            "sl": bid + stop_loss_pips * point,
-            "tp": bid - take_profit_pips * point,
-            "deviation": 20,
-            "magic": 234000,
-            "comment": signal.open_position,
-            "type_time": mt5.ORDER_TIME_GTC,
-            "type_filling": mt5.ORDER_FILLING_IOC,
-        }
+    async def enter_short(self, signal: TradingSignal):
+        return await self._run_in_executor(self._enter, signal, ActionType.SELL)
 
-        trade_result = mt5.order_send(trade_request)
-        logging.debug(f"Trade result: {trade_result}")
-        if trade_result.retcode != mt5.TRADE_RETCODE_DONE:
-            logging.error("Trade failed, retcode={}".format(trade_result.retcode))
-            logging.error(mt5.last_error())
-            raise Exception("Trade failed")
-        else:
-            logging.info(f"Enter short {signal.open_position} processed successfully!")
-        return trade_result
+    async def close_all_positions(self) -> bool:
+        """ 平掉所有持仓，全部成功时返回 True """
+        async with self._close_all_lock:
+            return await self._close_all_positions_locked()
 
-    def close_all_positions(self):
-        positions = mt5.positions_get()
+    async def _close_all_positions_locked(self) -> bool:
+        # 持有锁之后再取持仓，前一轮已经平掉的仓位不会再提交一次
+        positions = await self._run_in_executor(mt5.positions_get)
         if positions is None:
             logging.error("Error: Unable to retrieve positions")
-            return
-        for position in positions:
-            self.close_position_by_comment(position.comment)
-
-    @retry(retry=retry_if_result(is_requote_error), stop=stop_after_attempt(5), wait=wait_fixed(1),
-           reraise=True, after=after_log(logger, logging.DEBUG))
-    def close_position_by_comment(self, comment):
+            return False
+        # 并发提交平仓单，由信号量限制同时进行的 MT5 调用数；
+        # 等所有平仓单都有结果再返回，某一笔失败不影响其他仓位，也不会被吞掉
+        results = await asyncio.gather(*(self._close_position_async(position) for position in positions),
+                                       return_exceptions=True)
+        all_closed = True
+        for position, result in zip(positions, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to close %s (ticket %s): %s", position.comment, position.ticket, result,
+                             exc_info=result)
+                all_closed = False
+            elif result is None:
+                # order_send 没有返回结果，_close_position 已经记录了错误
+                all_closed = False
+        return all_closed
+
+    async def _close_position_async(self, position):
+        async with self._close_semaphore:
+            return await self._run_in_executor(self._close_position, position)
+
+    async def close_position_by_comment(self, comment):
+        return await self._run_in_executor(self._close_position_by_comment_sync, comment)
+
+    def _close_position_by_comment_sync(self, comment):
         # Get all positions
         positions = mt5.positions_get()
 
@@ -312,130 +503,117 @@ class TradingBot:
             return
 
         # Find the position with the specified comment
-        position_info = None
         for position in positions:
             if position.comment == comment:
-                position_info = position
-                break
+                return self._close_position(position)
 
-        if position_info is None:
-            logging.error(f"Error: Position with comment {comment} does not exist")
-            return
+        logger.error("Error: Position with comment %s does not exist", comment)
 
-        # Look for the position with the specified comment
-        for position in positions:
-            if position.comment == comment:
-                # Update the symbol's tick info
-
-                # Get the current bid and ask prices
-                symbol_info_tick = mt5.symbol_info_tick(position.symbol)
-                bid = symbol_info_tick.bid
-                ask = symbol_info_tick.ask
-                point = mt5.symbol_info(position.symbol).point
-                if position.type == mt5.POSITION_TYPE_BUY:
-                    price = bid
-                    sl = price - 100 * point
-                    tp = price + 100 * point
-                else:
-                    price = ask
-                    sl = price + 100 * point
-                    tp = price - 100 * point
-
-                trade_request = {
-                    "action": mt5.TRADE_ACTION_DEAL,
-                    "symbol": position.symbol,
-                    "volume": position.volume,
-                    "type": mt5.ORDER_TYPE_SELL if position.type == mt5.POSITION_TYPE_BUY else mt5.ORDER_TYPE_BUY,
-                    "price": bid if position.type == mt5.POSITION_TYPE_BUY else ask,
-                    "deviation": 30,  # Increase the allowed deviation
-                    "magic": 234000,
-                    "comment": f"closed {position.ticket}",
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_FOK,
-                    "position": position.ticket,
-                }
-
-                # Execute the trade request
-                trade_result = mt5.order_send(trade_request)
-                logging.debug(f"Trade result: {trade_result}")
-                if trade_result is None:
-                    logging.error("Error: Order send result is None")
-                    return
-                if trade_result.retcode != mt5.TRADE_RETCODE_DONE:
-                    logging.error("Trade failed, retcode={}".format(trade_result.retcode))
-                    logging.error(mt5.last_error())
-                    raise Exception("Trade failed")
-                else:
-                    logging.info(f"Close {comment} processed successfully!")
-                return trade_result
+    @retry(retry=retry_if_result(is_requote_error), stop=stop_after_attempt(5), wait=wait_fixed(1),
+           reraise=True, after=after_log(logger, logging.WARNING))
+    def _close_position(self, position):
+        # Close a long at the bid and a short at the ask
+        is_buy = position.type == mt5.POSITION_TYPE_BUY
+        symbol_info_tick = mt5.symbol_info_tick(position.symbol)
 
-    def is_trading_time(self):
-        # 获取当前服务器时间（这将根据你的服务器设置返回不同的时间）
-        server_time = datetime.now()
-        tradetime = 1
-        # 将服务器时间转换为北京时间
-        beijing_time = server_time.astimezone(pytz.timezone('Asia/Shanghai'))
-
-        # 获取当前小时和星期几
-        hour = beijing_time.hour
-        day_of_week = beijing_time.weekday()
-
-        # 判断是否在交易时间内
-        if day_of_week >= 5 or (hour >= 4 and hour < 7):
-            tradetime = 0
-            print("非交易时间")
+        trade_request = {
+            "action": mt5.TRADE_ACTION_DEAL,
+            "symbol": position.symbol,
+            "volume": position.volume,
+            "type": mt5.ORDER_TYPE_SELL if is_buy else mt5.ORDER_TYPE_BUY,
+            "price": symbol_info_tick.bid if is_buy else symbol_info_tick.ask,
+            "deviation": 30,  # Increase the allowed deviation
+            "magic": self.settings.magic,
+            "comment": f"closed {position.ticket}",
+            "type_time": mt5.ORDER_TIME_GTC,
+            "type_filling": mt5.ORDER_FILLING_FOK,
+            "position": position.ticket,
+        }
+
+        # Execute the trade request
+        trade_result = self._order_send(trade_request)
+        logger.debug("Trade result: %s", trade_result)
+        if trade_result is None:
+            logging.error("Error: Order send result is None")
+            return
+        if trade_result.retcode != mt5.TRADE_RETCODE_DONE:
+            logger.error("Trade failed, retcode=%s", trade_result.retcode)
+            logging.error(mt5.last_error())
+            raise Exception("Trade failed")
         else:
-            tradetime = 1
-            print("正常交易中")
-        
-        return tradetime
+            logger.info("Close %s processed successfully!", position.comment)
+        return trade_result
+
+    def is_trading_time(self):
+        # 交易时段按分钟判断就够了，同一分钟内的信号直接复用结果
+        return _tradetime(int(time.time() // 60))
+
+
+async def order_worker(orders: asyncio.Queue):
+    """ 依次执行一个队列里的信号 """
+    while True:
+        signal = await orders.get()
+        await trading_bot.execute_order(signal)
+
+
+async def run_order_workers(order_queues: list[asyncio.Queue]):
+    """ 每个队列一个 worker，由 TaskGroup 统一管理 """
+    async with asyncio.TaskGroup() as tg:
+        for orders in order_queues:
+            tg.create_task(order_worker(orders))
 
 
 @app.route('/webhook', methods=['POST'])
 async def webhook_handler(request):
     try:
-        signal = TradingSignal.from_webhook(request.body.decode())
-        signal = signal.normalize_action()
-        task = asyncio.create_task(trading_bot.execute_order(signal))
-        task.add_done_callback(task_callback)
-        return sanic_json({'message': 'Signal received'}, status=200)
+        signal = TradingSignal.from_webhook(request.body)
+        orders = request.app.ctx.order_queues[hash(signal.symbol) % ORDER_WORKERS]
+        try:
+            orders.put_nowait(signal)
+        except asyncio.QueueFull:
+            logger.error("Order queue is full, dropping signal: %s", signal)
+            return sanic_json({'message': 'Too many pending signals'}, status=503)
+        return HTTPResponse(_ACK_BODY, status=200, content_type='application/json')
     except ValueError as e:
         return sanic_json({'message': str(e)}, status=400)
 
 
 @app.listener('before_server_start')
 async def init(app, loop):
-    if not mt5.initialize():
-        logger.error("Failed to connect to MetaTrader 5: %s", mt5.last_error())
-        sys.exit(1)
-
-    authorized = mt5.login(login=login, password=password, server=server)
-    if not authorized:
-        logging.error(f"Failed to connect to trade account with login = {login}")
-        logging.error(f"Error code = , {mt5.last_error()}")
-        quit()
+    # MT5 连接不能跨进程共享，在服务进程里建立连接
+    global trading_bot
+    trading_bot = TradingBot(settings)
 
-    logging.info(f"Connected to trade account with login = {login}")
+    # 信号先进队列，由后台 worker 统一执行，webhook 里不再逐个创建任务；
+    # 按品种分片到有界队列，不同品种并行，同一品种保持顺序
+    app.ctx.order_queues = [asyncio.Queue(maxsize=ORDER_QUEUE_SIZE) for _ in range(ORDER_WORKERS)]
+    app.ctx.order_workers = asyncio.create_task(run_order_workers(app.ctx.order_queues))
+    app.ctx.order_workers.add_done_callback(task_callback)
 
 
 @app.listener('before_server_stop')
 async def close(app, loop):
+    app.ctx.order_workers.cancel()
+    trading_bot.shutdown()
     mt5.shutdown()
     logger.info("Disconnected from MetaTrader 5")
+    stop_log_listener()
 
 
 def task_callback(task):
+    # 正常停机时任务是被取消的，task.result() 会抛出 CancelledError (不是 Exception 的子类)
+    if task.cancelled():
+        return
     try:
         task.result()
-    except Exception as e:
-        logger.error(f"An error occurred during task execution: {e}")
+    except Exception:
+        logger.exception("An error occurred during task execution")
 
 
 def main():
-    global trading_bot
-    trading_bot = TradingBot(login, password, server)
-    print(trading_bot)
-    app.run(host="0.0.0.0", port=8099, debug=True)
+    # 只用一个进程: 订单队列、下单锁和 MT5 连接都是进程内的，多进程会让同一品种的信号
+    # 在不同进程里乱序/并发执行，收盘时每个进程也都会去平同一批仓位
+    app.run(host="0.0.0.0", port=8099, workers=1, debug=False, access_log=False)
 
 if __name__ == "__main__":
     main()